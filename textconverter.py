@@ -1,15 +1,19 @@
 from __future__ import annotations
 from pathlib import Path
 from types import FunctionType
+import bisect
 import dataclasses
 import enum
+import io
+import itertools
 import logging
 import re
-import textwrap
+import sys
 import typing
 
 from pdfminer.image import ImageWriter
 from pdfminer.layout import (
+    LTChar,
     LTItem,
     LTPage,
     LTTextBox,
@@ -21,6 +25,10 @@ from pdfminer.converter import TextConverter as TextConverterBase
 
 log = logging.getLogger(__name__)
 
+_RE_MULTI_SPACE = re.compile(r' (\s+)')
+_RE_FIGURE_REF = re.compile(r'\bFigure (\d+)\.(\d+)\b')
+_RE_ENUM_LIST = re.compile(r'\d+\.\s*')
+
 font_warning_cache = {}
 
 
@@ -41,33 +49,71 @@ def font_warning(fontname, fontsize, current_line):
 InlineStyle = typing.Literal['normal', 'strong', 'em', 'code', 'term']
 
 
-@dataclasses.dataclass
+def join_hyphen_break(text: str) -> str:
+    # Self- Taught のような分断を結合
+    pos = text.find('- ')
+    if pos < 0:
+        return text
+
+    parts = []
+    start = 0
+    last_end = 0
+    while pos >= 0:
+        after = pos + 2
+        if (pos > last_end and after < len(text)
+                and (text[pos - 1].isalnum() or text[pos - 1] == '_')
+                and (text[after].isalnum() or text[after] == '_')):
+            parts.append(text[start:pos + 1])  # keep '-', drop ' '
+            start = after
+            last_end = after + 1
+        pos = text.find('- ', pos + 1)
+    parts.append(text[start:])
+    return ''.join(parts)
+
+
+def split_spaces(text: str) -> tuple[str, str, str]:
+    # (leading spaces, text, trailing spaces)
+    core = text.lstrip()
+    pre_s = text[:len(text) - len(core)]
+    core = core.rstrip()
+    post_s = text[len(pre_s) + len(core):]
+    return pre_s, core, post_s
+
+
+@dataclasses.dataclass(slots=True, repr=False)
 class InlineElement:
     parent: BlockElement
     style: InlineStyle = 'normal'
     text_stack: list[str] = dataclasses.field(default_factory=list)
+    _raw_text_cache: tuple[InlineStyle, str]|None = dataclasses.field(default=None, init=False, repr=False, compare=False)
 
     def __repr__(self):
         return f'{self.__class__.__name__}(style={self.style}, {self.raw_text[:20]!r})'
 
     def push_text(self, text: str) -> None:
         self.text_stack.append(text)
+        self._raw_text_cache = None
 
     @property
     def raw_text(self):
-        text = ''.join(self.text_stack)
-        text = re.sub(r'(\w)- (\w)', r'\1-\2', text)  # Self- Taught のような分断を結合
+        # style may be overwritten after the text is computed (e.g. glossary term)
+        if self._raw_text_cache is not None and self._raw_text_cache[0] == self.style:
+            return self._raw_text_cache[1]
+        text = ''.join(self.text_stack).replace('\xa0', ' ')
+        text = join_hyphen_break(text)
         if not self.style == 'code':
-            text = re.sub(r' (\s+)', ' ', text)  # 連続する空白を除去
+            text = _RE_MULTI_SPACE.sub(' ', text)  # 連続する空白を除去
+        self._raw_text_cache = (self.style, text)
         return text
 
     def replace_inlines(self, text):
-        text = re.sub(r'\bFigure (\d+)\.(\d+)\b', r':numref:`figure-\1-\2`', text) 
+        if 'Figure ' in text:
+            text = _RE_FIGURE_REF.sub(r':numref:`figure-\1-\2`', text)
         return text
 
     def render(self, in_code=False):
         text = self.raw_text
-        pre_s, text, post_s = re.match(r'^(\s*)(.*?)(\s*)$', text, re.DOTALL).groups()
+        pre_s, text, post_s = split_spaces(text)
 
         match self.style:
             case 'normal' | 'lineblock' | 'list-item':
@@ -77,7 +123,7 @@ class InlineElement:
             case 'em':
                 text = f'*{text}*'
             case 'code' if not in_code:
-                if not re.match(r'^https?://', text):  # except URL
+                if not text.startswith(('http://', 'https://')):  # except URL
                     text = f'``{text}``'
             case 'code' | 'header' | 'figure' | 'figure-comment' | 'toc' | 'part' | 'h1' | 'h2' | 'h3':
                 pass  # as is
@@ -91,22 +137,54 @@ class InlineElement:
 
 def trim_linebreak(text: str):
     # remove '\n'
-    text = text.replace('-\n', '')
-    text = re.sub(r'([^ ])\n([^ ])', r'\1 \2', text)
-    text = text.replace('\n', '')
-    return text
+    if '\n' not in text:
+        return text
+    if '-\n' in text:
+        text = text.replace('-\n', '')
+        if '\n' not in text:
+            return text
+
+    # '\n' between non-space chars becomes ' ', other '\n' are removed.
+    # a char joined after '\n' can not start the next join, as in re.sub(r'([^ ])\n([^ ])', r'\1 \2').
+    parts = []
+    start = 0
+    last_end = 0
+    pos = text.find('\n')
+    while pos >= 0:
+        parts.append(text[start:pos])
+        if pos > last_end and pos + 1 < len(text) and text[pos - 1] != ' ' and text[pos + 1] != ' ':
+            parts.append(' ')
+            last_end = pos + 2
+        start = pos + 1
+        pos = text.find('\n', start)
+    parts.append(text[start:])
+    return ''.join(parts)
+
+
+def indent(text: str, prefix: str) -> str:
+    # same as textwrap.indent(text, prefix), without a predicate call per line
+    return ''.join([prefix + line if line.strip() else line for line in text.splitlines(True)])
 
 
 BlockStyle = typing.Literal['part', 'code', 'h1', 'h2', 'h3', 'paragraph', 'lineblock', 'header', 'figure', 'figure-comment', 'toc', 'list-item', 'enum-list']
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, repr=False)
 class BlockElement:
     parent: ChapterElement
     item: LTTextBoxHorizontal
     _style: BlockStyle = None
     inlines: list[InlineElement] = dataclasses.field(default_factory=list, repr=False, init=False)
     page: LTPage = dataclasses.field(default=None, repr=False)
+    _style_cache: BlockStyle = dataclasses.field(default=None, repr=False, init=False)
+    _render_text_cache: str = dataclasses.field(default=None, repr=False, init=False)
+    _inline_styles_cache: frozenset[InlineStyle] = dataclasses.field(default=None, repr=False, init=False)
+    _is_page_header: bool = dataclasses.field(default=False, repr=False, init=False)
+    _firstline_x: float = dataclasses.field(default=None, repr=False, init=False)
+
+    def __post_init__(self):
+        # it seems a page header
+        self._is_page_header = self.item is not None and self.item.y0 > 610
 
     def __repr__(self):
         if not self.item:
@@ -120,12 +198,22 @@ class BlockElement:
         return bool(self.inlines)
 
     def get_firstline_x(self):
-        return list(self.item)[0].x0
+        if self._firstline_x is None:
+            self._firstline_x = next(iter(self.item)).x0
+        return self._firstline_x
+
+    def clear_cache(self) -> None:
+        self._style_cache = None
+        self._render_text_cache = None
+        self._inline_styles_cache = None
+
     def set_inline_style(self, style: InlineStyle):
         if not self.inlines:
             self.inlines.append(InlineElement(self, style=style))
+            self.clear_cache()
         elif self.inlines[-1].style != style:
             self.inlines.append(InlineElement(self, style=style))
+            self.clear_cache()
         else:
             pass  # style is not changed.
 
@@ -133,28 +221,39 @@ class BlockElement:
         if not self.inlines:
             self.inlines.append(InlineElement(self))
         self.inlines[-1].push_text(text)
+        self.clear_cache()
 
     def merge(self, other: BlockElement) -> None:
         self.inlines.extend(other.inlines)
+        self.clear_cache()
+
+    @property
+    def inline_styles(self) -> frozenset[InlineStyle]:
+        if self._inline_styles_cache is None:
+            self._inline_styles_cache = frozenset(i.style for i in self.inlines)
+        return self._inline_styles_cache
 
     def is_all_style(self, *styles: list[InlineStyle]):
-        return all(i.style in styles for i in self.inlines)
+        return self.inline_styles.issubset(styles)
 
     def is_any_style(self, *styles: list[InlineStyle]):
-        return any(i.style in styles for i in self.inlines)
+        return not self.inline_styles.isdisjoint(styles)
 
     def is_style(self, *, require: InlineStyle, accepts: list[InlineStyle]):
-        subjects = [i.style for i in self.inlines]
+        subjects = self.inline_styles
         if require not in subjects:
             return False
-        return all(s in (require, *accepts) for s in subjects)
+        return subjects.issubset((require, *accepts))
 
     @property
     def style(self) -> BlockStyle:
         if self._style is not None:
             return self._style
+        if self._style_cache is None:
+            self._style_cache = self.guess_style()
+        return self._style_cache
 
-        # guess
+    def guess_style(self) -> BlockStyle:
         if self.is_header:
             return 'header'
         if self.is_style(require='code', accepts=['strong']):
@@ -174,20 +273,17 @@ class BlockElement:
             log.warning('Block style is changed: %r -> %r for (page %r) %r',
                 self._style, style, self.page.pageid, self.item.get_text())
         self._style = style
+        self.clear_cache()
 
     @property
     def is_header(self):
-        if self._style == 'header':
-            return True
-        elif self.item is None:
-            return False
-        return self.item.y0 > 610  # it seems a page header
+        return self._style == 'header' or self._is_page_header
 
     @property
     def is_enumlist(self):
         first: InlineElement = self.inlines[0]
         if first.style == 'header':
-            if re.match(r'\d+\.\s*', first.raw_text):
+            if _RE_ENUM_LIST.match(first.raw_text):
                 return True
         return False
 
@@ -196,16 +292,17 @@ class BlockElement:
             header = '.. parsed-literal::\n\n'
         else:
             header = '.. code-block::\n\n'
-        text = ''.join(i.render(in_code=True) for i in self.inlines)
-        suite = textwrap.indent(text, '   ').rstrip()
+        text = ''.join([i.render(in_code=True) for i in self.inlines])
+        suite = indent(text, '   ').rstrip()
         return header + suite
 
     def render_figure(self):
-        text = ''.join(i.raw_text for i in self.inlines)  # 1 line
-        figname, figtitle = [t.strip() for t in text.split(':', 2)]
-        figname = figname.lower().replace(' ', '-').replace('.', '-')
+        text = ''.join([i.raw_text for i in self.inlines])  # 1 line
+        figname, _, figtitle = text.partition(':')
+        figname = figname.strip().lower().replace(' ', '-').replace('.', '-')
+        figtitle = figtitle.strip()
         header = f'.. figure:: images/{figname}.*\n   :name: {figname}\n\n'
-        suite = textwrap.indent(figtitle, '   ').rstrip()
+        suite = indent(figtitle, '   ').rstrip()
         return header + suite
 
     def render_glossary(self):
@@ -222,46 +319,53 @@ class BlockElement:
         texts = []
         for term, *descs in stack:
             # drop empty inline and insert ' ' between inlines
-            desc = ' '.join(t for t in descs if t.strip())
+            desc = ' '.join([t for t in descs if t.strip()])
             desc = trim_linebreak(desc)
             texts.append(f'{term}\n   {desc}')
 
         header = '.. glossary::\n\n'
-        suite = textwrap.indent('\n\n'.join(texts), ' '*3)
+        suite = indent('\n\n'.join(texts), ' '*3)
         return header + suite
 
     def render_text(self):
+        # the inlines are merged in place below, so the result must be computed only once.
+        if self._render_text_cache is None:
+            self._render_text_cache = self._render_text()
+        return self._render_text_cache
+
+    def _render_text(self):
         if self.is_header:
             return ''  # remove page header
 
         # remove style from single ' '
         stack: list[InlineElement] = []
         for i in self.inlines:
-            match stack:
-                case *_,i2,i1 if i1.raw_text == ' ' and i2.style == i.style:
-                    i2.push_text(i1.raw_text)
-                    i2.push_text(i.raw_text)
-                    stack.pop()  # discard i1
-                case _:
-                    stack.append(i)
+            if len(stack) >= 2 and stack[-1].raw_text == ' ' and stack[-2].style == i.style:
+                i2 = stack[-2]
+                i2.push_text(' ')
+                i2.push_text(i.raw_text)
+                stack.pop()  # discard i1
+            else:
+                stack.append(i)
 
         # drop empty inline and insert ' ' between inlines
-        text = ' '.join(t for t in (i.render() for i in stack) if t)
+        text = ' '.join([t for t in (i.render() for i in stack) if t])
         text = trim_linebreak(text)
         return text
 
     def render(self) -> str:
+        style = self.style
         if self.item is None:
             return ''
-        elif self.style == 'code':
+        elif style == 'code':
             return self.render_code()
-        elif self.style == 'figure':
+        elif style == 'figure':
             return self.render_figure()
-        elif self.style == 'glossary':
+        elif style == 'glossary':
             return self.render_glossary()
 
         text = self.render_text()
-        match self.style:
+        match style:
             case 'figure-comment':
                 text = '.. figure-comment: ' + text
             case 'toc':
@@ -285,21 +389,28 @@ class BlockElement:
         return text
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class ChapterElement:
     blocks: list[BlockElement] = dataclasses.field(default_factory=list)
-    page_blocks: list[BlockElement] = dataclasses.field(default_factory=list)
+    # (-y0, seq, block): kept sorted from the top of the page, in creation order for the same y0.
+    page_blocks: list[tuple[float, int, BlockElement]] = dataclasses.field(default_factory=list)
+    current_block: BlockElement = dataclasses.field(default=None, repr=False)
+    _current_key: tuple[float, int] = dataclasses.field(default=None, repr=False, init=False)
+    _seq: itertools.count = dataclasses.field(default_factory=itertools.count, repr=False, init=False)
 
     def close_page(self) -> None:
-        self.blocks.extend(sorted(self.page_blocks, key=lambda b: b.item.y0, reverse=True))
+        self.blocks.extend(b for _, _, b in self.page_blocks)
         self.page_blocks = []
+        self.current_block = None
 
     def new_block(self, box: LTTextBoxHorizontal, page: LTPage):
-        if self.page_blocks and not self.page_blocks[-1]:
+        if self.current_block is not None and not self.current_block:
             # 最後のblockが空なら捨てる（あるいは上書きする必要ある？）
-            self.page_blocks.pop()
+            del self.page_blocks[bisect.bisect_left(self.page_blocks, self._current_key)]
         block = BlockElement(self, box, page=page)
-        self.page_blocks.append(block)
+        self._current_key = (-box.y0, next(self._seq))
+        bisect.insort(self.page_blocks, (*self._current_key, block))
+        self.current_block = block
 
     def merge_blocks(self) -> None:
         blocks = [BlockElement(self, None)]
@@ -307,17 +418,18 @@ class ChapterElement:
             prev = blocks[-1]
             if b.is_header:
                 continue  # skip page header
-            if b.style == 'code':
-                if prev.style == 'code':
+            style, prev_style = b.style, prev.style
+            if style == 'code':
+                if prev_style == 'code':
                     prev.merge(b)
                 else:
                     blocks.append(b)
             else:  # text
-                if prev.style == b.style == 'paragraph' and prev.item is not b.item and 47.9 <= round(b.get_firstline_x(), 1) <= 48.0:
+                if prev_style == style == 'paragraph' and prev.item is not b.item and 47.9 <= round(b.get_firstline_x(), 1) <= 48.0:
                     # 1つのパラグラフが複数blockに分かれている
                     log.info('merge block: %r', b)
                     prev.merge(b)
-                elif prev.style == 'enum-list' and 78.0 <= round(b.get_firstline_x(), 1) <= 80.0:
+                elif prev_style == 'enum-list' and 78.0 <= round(b.get_firstline_x(), 1) <= 80.0:
                     # 1つの番号付き箇条書きが複数blockに分かれている
                     log.info('merge block: %r', b)
                     prev.merge(b)
@@ -350,22 +462,23 @@ class ChapterElement:
         self.blocks = blocks
 
     def get_block_style(self):
-        return self.page_blocks[-1].style
+        return self.current_block.style
 
     def set_inline_style(self, style):
-        self.page_blocks[-1].set_inline_style(style)
+        self.current_block.set_inline_style(style)
 
     def push_text(self, text: str) -> None:
-        self.page_blocks[-1].push_text(text)
+        self.current_block.push_text(text)
 
     def render(self):
         self.merge_blocks()
         self.merge_glossaries()
-        texts = []
+        buf = io.StringIO()
         for b in self.blocks:
             # log.warning(b)
-            texts.extend([b.render(), '\n\n'])
-        return ''.join(texts)
+            buf.write(b.render())
+            buf.write('\n\n')
+        return buf.getvalue()
 
 
 # <LTTextBoxHorizontal(7) 60.000,363.008,165.462,383.006 'for i in range(1, 6):\n    print(i)\n'>
@@ -393,13 +506,57 @@ class Font(str, enum.Enum):
     LIST_ITEM = 'OXPSJB+ZapfDingbatsStd'
 
 
-@dataclasses.dataclass
+# fontnames are interned so that lookups with interned pdfminer fontnames compare by identity.
+# fontname -> inline style, for any size.
+_FONT_STYLES: dict[str, InlineStyle] = {sys.intern(f): style for f, style in {
+    Font.CODE.value: 'code',
+    Font.HEADER.value: 'header',
+    Font.PARAGRAPH.value: 'normal',
+    Font.STRONG.value: 'strong',
+    Font.CODE_BOLD.value: 'strong',
+    Font.EM.value: 'em',
+    Font.FIGURE_C1.value: 'figure-comment',
+    Font.FIGURE_C2.value: 'figure-comment',
+    Font.FIGURE_C3.value: 'figure-comment',
+    Font.FIGURE_C4.value: 'figure-comment',
+    Font.FIGURE_C5.value: 'figure-comment',
+    Font.FIGURE_C6.value: 'figure-comment',
+    Font.LIST_ITEM.value: 'list-item',
+}.items()}
+
+# (fontname, rounded size) -> inline style, for fonts used with several sizes.
+_FONT_SIZE_STYLES: dict[tuple[str, float], InlineStyle] = {(sys.intern(f), size): style for (f, size), style in {
+    (Font.HEADING.value, 50): 'normal',  # title
+    (Font.HEADING.value, 40): 'part',
+    (Font.HEADING.value, 30): 'h1',
+    (Font.HEADING.value, 28): 'h1',
+    (Font.HEADING.value, 18): 'h2',
+    (Font.HEADING.value, 15): 'h3',
+    (Font.HEADING.value, 14.5): 'lineblock',
+    (Font.HEADING.value, 9.0): 'figure',
+    (Font.TOC1.value, 12): 'toc',
+    (Font.TOC1.value, 10): 'toc',
+    (Font.TOC2.value, 12): 'toc',
+    (Font.TOC2.value, 10): 'toc',
+}.items()}
+
+
+def find_inline_style(item: LTChar) -> InlineStyle|None:
+    fontname = sys.intern(item.fontname)
+    style = _FONT_STYLES.get(fontname)
+    if style is None:
+        style = _FONT_SIZE_STYLES.get((fontname, round(item.size, 1)))
+    return style
+
+
+@dataclasses.dataclass(slots=True)
 class Visitor:
     imagewriter: ImageWriter|None = None
     chap: ChapterElement = dataclasses.field(default_factory=ChapterElement)
     current_page: LTPage = dataclasses.field(default=None, init=False, repr=False)
     current_box: LTTextBoxHorizontal = dataclasses.field(default=None, init=False, repr=False)
     current_line: LTTextLineHorizontal = dataclasses.field(default=None, init=False, repr=False)
+    _dispatch_cache: dict[type, tuple[tuple, tuple]] = dataclasses.field(default_factory=dict, init=False, repr=False)
 
     def walk(self, item: LTItem):
         self.dispatch(item)
@@ -409,24 +566,45 @@ class Visitor:
         return self.chap.render()
 
     def dispatch(self, item: LTItem):
-        for visit in self.get_functions(item, 'visit'):
+        cls = type(item)
+        entry = self._dispatch_cache.get(cls)
+        if entry is None:
+            entry = self._dispatch_cache[cls] = self.build_dispatch(cls)
+        visits, departs = entry
+        for visit in visits:
             visit(item)
-        for depart in self.get_functions(item, 'depart'):
+        for depart in departs:
             depart(item)
 
-    def get_functions(self, item: LTItem, prefix: str) -> FunctionType|None:
-        # print(prefix, item.__class__.mro())
-        for c in item.__class__.mro():
+    def build_dispatch(self, cls: type) -> tuple[tuple, tuple]:
+        return self.get_functions(cls, 'visit'), self.get_functions(cls, 'depart')
+
+    def get_functions(self, cls: type, prefix: str) -> tuple[FunctionType, ...]:
+        # print(prefix, cls.mro())
+        functions = []
+        for c in cls.mro():
             if c.__module__ != 'pdfminer.layout':
                 continue
             visit = getattr(self, f'{prefix}_{c.__name__}', None)
             if visit is not None:
-                yield visit
-        return None
+                functions.append(visit)
+        return tuple(functions)
 
     def push_text(self, text):
-        text = text.replace('\xa0', ' ')
-        self.chap.push_text(text)
+        self.chap.push_text(text)  # '\xa0' is normalized by InlineElement.raw_text
+
+    def push_run(self, style: InlineStyle|None, texts: list[str]) -> None:
+        if not texts:
+            return
+        block = self.chap.current_block
+        if style is not None:
+            block.set_inline_style(style)
+        block.push_text(''.join(texts))
+
+    def get_unknown_style(self, item: LTChar) -> InlineStyle:
+        if self.chap.get_block_style() != 'header':
+            font_warning(item.fontname, round(item.size, 1), self.current_line)
+        return 'normal'
 
     def visit_LTTextBoxHorizontal(self, item: LTItem) -> None:
         # log.warning("%s-%d (%f,%f):%s", self.current_page.pageid, item.index, item.x0, item.y0, item.get_text().split('\n')[0][:20])
@@ -442,52 +620,39 @@ class Visitor:
             self.chap.new_block(self.current_box, self.current_page)
         self.current_line = item
 
+        # push texts per style run instead of per character.
+        # LTAnno has no font, so it belongs to the preceding run.
+        run_style = None
+        run_font = None
+        run: list[str] = []
+        for child in item:
+            if isinstance(child, LTChar):
+                font = (child.fontname, child.size)
+                if font != run_font:  # same font means same style
+                    run_font = font
+                    style = find_inline_style(child)
+                    if style is None or style != run_style:
+                        # unknown font warning depends on the texts pushed so far
+                        self.push_run(run_style, run)
+                        run = []
+                        run_style = style or self.get_unknown_style(child)
+            run.append(child.get_text())
+        self.push_run(run_style, run)
+
     def visit_LTPage(self, item: LTItem) -> None:
         self.chap.close_page()
         self.current_page = item
 
     def visit_LTContainer(self, item: LTItem) -> None:
+        if isinstance(item, LTTextLineHorizontal):
+            return  # characters are pushed by visit_LTTextLineHorizontal
         for child in item:
             child.parent = item
             self.dispatch(child)
 
     def visit_LTChar(self, item: LTItem) -> None:
-        match item.fontname, round(item.size, 1):
-            case Font.CODE, _:
-                self.chap.set_inline_style('code')
-            case Font.HEADING, 50:  # title
-                self.chap.set_inline_style('normal')
-            case Font.HEADING, 40:
-                self.chap.set_inline_style('part')
-            case Font.HEADING, 30 | 28:
-                self.chap.set_inline_style('h1')
-            case Font.HEADING, 18:
-                self.chap.set_inline_style('h2')
-            case Font.HEADING, 15:
-                self.chap.set_inline_style('h3')
-            case Font.HEADING, 14.5:
-                self.chap.set_inline_style('lineblock')
-            case Font.HEADING, 9.0:
-                self.chap.set_inline_style('figure')
-            case Font.HEADER, _:
-                self.chap.set_inline_style('header')
-            case Font.PARAGRAPH, _:
-                self.chap.set_inline_style('normal')
-            case Font.STRONG | Font.CODE_BOLD, _:
-                self.chap.set_inline_style('strong')
-            case Font.EM, _:
-                self.chap.set_inline_style('em')
-            case Font.FIGURE_C1 | Font.FIGURE_C2 | Font.FIGURE_C3 | Font.FIGURE_C4 | Font.FIGURE_C5| Font.FIGURE_C6, _:
-                self.chap.set_inline_style('figure-comment')
-            case Font.TOC1 | Font.TOC2, 12 | 10:
-                self.chap.set_inline_style('toc')
-            case Font.LIST_ITEM, _:
-                self.chap.set_inline_style('list-item')
-            case fontname, fontsize:
-                # unknown
-                if self.chap.get_block_style() != 'header':
-                    font_warning(fontname, fontsize, self.current_line)
-                self.chap.set_inline_style('normal')
+        style = find_inline_style(item) or self.get_unknown_style(item)
+        self.chap.set_inline_style(style)
 
         self.push_text(item.get_text())
 
@@ -540,19 +705,29 @@ class SplitRstConverter(TextConverterBase):
         chap.close_page()
         chap.merge_blocks()
         chap.merge_glossaries()
-        
+
         part_counter = 0
         chap_counter = 0
-        for b in chap.blocks:
-            match b.style:
-                case 'part':
-                    fname = f'Part{part_counter}.rst'
-                    self.outfp = (self.base_path / fname).open('wb')
-                    part_counter += 1
-                case 'h1' if part_counter != 1:
-                    chap_counter += 1
-                    t = b.render_text().replace('?', '').replace(':', '').replace(' ', '-')
-                    fname = f'Chap{chap_counter:02}-{t}.rst'
-                    self.outfp = (self.base_path / fname).open('wb')
-            self.write_text(b.render())
-            self.write_text('\n\n')
\ No newline at end of file
+        texts: list[str] = []  # written once per output file
+        try:
+            for b in chap.blocks:
+                match b.style:
+                    case 'part':
+                        self.write_texts(texts)
+                        fname = f'Part{part_counter}.rst'
+                        self.outfp = (self.base_path / fname).open('wb')
+                        part_counter += 1
+                    case 'h1' if part_counter != 1:
+                        self.write_texts(texts)
+                        chap_counter += 1
+                        t = b.render_text().replace('?', '').replace(':', '').replace(' ', '-')
+                        fname = f'Chap{chap_counter:02}-{t}.rst'
+                        self.outfp = (self.base_path / fname).open('wb')
+                texts.extend([b.render(), '\n\n'])
+        finally:
+            self.write_texts(texts)  # keep the converted part on error
+
+    def write_texts(self, texts: list[str]) -> None:
+        if texts:
+            self.write_text(''.join(texts))
+            texts.clear()
\ No newline at end of file